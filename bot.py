@@ -1,15 +1,20 @@
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 import nsepython as nse
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TimedOut
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
-    ConversationHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 from nse_utils import (
     INDICES_LIST,
     INDICES,
@@ -34,133 +39,223 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Conversation states
-CHOOSING_TYPE = 1
-CHOOSING_INDEX = 2
-CHOOSING_STOCK = 3
-CHOOSING_EXPIRY = 4
-SHOW_CHAIN = 5
+async def _call_with_retry(func, *args, **kwargs):
+    """Call an outbound Telegram method, retrying on TimedOut with backoff.
+
+    Under pool pressure a send can time out transiently; retry up to 3
+    attempts with 0.5 -> 1 -> 2s backoff before giving up.
+    """
+    delay = 0.5
+    for attempt in range(3):
+        try:
+            return await func(*args, **kwargs)
+        except TimedOut:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+# ========= Static keyboards ========= #
+# These keyboards never change, so build them once at import instead of
+# allocating fresh button/markup objects on every callback.
+
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Option Chain", callback_data="option_chain")],
+    [InlineKeyboardButton("📈 Market Data", callback_data="market_menu")],
+    [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
+])
+
+OPTION_CHAIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📈 Index Options", callback_data="index_options")],
+    [InlineKeyboardButton("📉 Stock Options", callback_data="stock_options")],
+    [InlineKeyboardButton("🧮 Market Data", callback_data="market_menu")],
+    [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
+    [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
+])
+
+MARKET_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔥 Most Active", callback_data="most_active")],
+    [InlineKeyboardButton("🕒 Preopen Movers", callback_data="preopen_movers")],
+    [InlineKeyboardButton("🏦 FII / DII", callback_data="fiidii")],
+    [InlineKeyboardButton("📦 Block Deals", callback_data="block_deals")],
+    [InlineKeyboardButton("📊 Bulk Deals", callback_data="bulk_deals")],
+    [InlineKeyboardButton("⚡ India VIX", callback_data="indiavix")],
+    [InlineKeyboardButton("📈 Top Gainers", callback_data="top_gainers")],
+    [InlineKeyboardButton("📉 Top Losers", callback_data="top_losers")],
+    [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
+    [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
+])
+
+AFTER_CHAIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 New Query", callback_data="option_chain")],
+    [InlineKeyboardButton("📈 Market Data", callback_data="market_menu")],
+    [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
+    [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
+])
+
+AFTER_MARKET_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔁 Market Menu", callback_data="market_menu")],
+    [InlineKeyboardButton("📊 Option Chain", callback_data="option_chain")],
+    [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
+    [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
+])
+
+# INDICES never changes at runtime, so the index picker is static too
+INDEX_KEYBOARD_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton(INDICES[idx], callback_data=f"idx_{idx}")]
+        for idx in INDICES_LIST
+    ]
+    + [[InlineKeyboardButton("🔙 Back", callback_data="option_chain")]]
+)
 
-# Store user states
-user_states = {}
 
+# ========= Warm cache for market data ========= #
+# Market data moves on market-minute cadence, not per user, so a background
+# job keeps a pre-formatted text per endpoint and callbacks serve straight
+# from the cache. The blocking NSE fetches always run in a worker thread so
+# they never stall the event loop.
+
+_MARKET_FORMATTERS = {
+    "most_active": format_most_active,
+    "preopen_movers": format_preopen_movers,
+    "fiidii": format_fiidii,
+    "block_deals": format_block_deals,
+    "bulk_deals": format_bulk_deals,
+    "indiavix": format_indiavix,
+    "top_gainers": format_top_gainers,
+    "top_losers": format_top_losers,
+}
+
+# Per-endpoint TTLs: VIX moves tick by tick, while FII/DII flows and
+# block/bulk deal lists only update on daily cadence.
+_MARKET_DEFAULT_TTL = 30
+_MARKET_TTLS = {
+    "indiavix": 10,
+    "fiidii": 60,
+    "block_deals": 60,
+    "bulk_deals": 60,
+}
+
+_MARKET_CACHE = {}  # key -> (formatted text, expires_at)
+
+
+async def _get_market_text(key: str) -> str:
+    """Serve a market-data text from the warm cache, fetching on cold miss."""
+    cached = _MARKET_CACHE.get(key)
+    if cached and time.monotonic() < cached[1]:
+        return cached[0]
+
+    text = await asyncio.to_thread(_MARKET_FORMATTERS[key])
+    ttl = _MARKET_TTLS.get(key, _MARKET_DEFAULT_TTL)
+    _MARKET_CACHE[key] = (text, time.monotonic() + ttl)
+    return text
+
+
+# One small pool for all refresh work keeps the number of concurrent
+# connections to NSE bounded regardless of how many endpoints are stale.
+_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="market-refresh")
+
+
+async def _refresh_market(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job-queue callback: re-fetch any market dataset whose TTL has lapsed.
+
+    The stale endpoints are independent I/O-bound fetches, so they run
+    concurrently on the shared executor and the refresh cycle takes as long
+    as the slowest endpoint rather than the sum of all of them.
+    """
+    stale = []
+    for key in _MARKET_FORMATTERS:
+        cached = _MARKET_CACHE.get(key)
+        if not cached or time.monotonic() >= cached[1]:
+            stale.append(key)
+
+    if not stale:
+        return
+
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(_REFRESH_EXECUTOR, _MARKET_FORMATTERS[key])
+            for key in stale
+        ),
+        return_exceptions=True,
+    )
 
-# ========= Helpers to format nsepython outputs ========= #
+    for key, text in zip(stale, results):
+        if isinstance(text, Exception):
+            logger.warning(f"Market data refresh failed for {key}: {str(text)}")
+            continue
 
+        ttl = _MARKET_TTLS.get(key, _MARKET_DEFAULT_TTL)
+        _MARKET_CACHE[key] = (text, time.monotonic() + ttl)
 
 
 # ========= Telegram handlers ========= #
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start the bot and show main menu."""
-    user_id = update.effective_user.id
-    user_states[user_id] = {}  # ← This clears user state (restart effect)
-
-    keyboard = [
-        [InlineKeyboardButton("📊 Option Chain", callback_data="option_chain")],
-        [InlineKeyboardButton("📈 Market Data", callback_data="market_menu")],
-        [InlineKeyboardButton("🔄 Restart", callback_data="restart")],  # ← New!
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    context.user_data.clear()  # ← This clears user state (restart effect)
 
     await update.message.reply_text(
         "👋 Welcome to NSE Option Chain Bot!\n\n"
         "Choose an option below:",
-        reply_markup=reply_markup,
+        reply_markup=MAIN_MENU_MARKUP,
     )
 
-    return CHOOSING_TYPE
-
-async def restart_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def restart_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Restart button - clears state and shows main menu."""
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer("🔄 Restarting...")
 
     # Clear user state completely
-    user_states[user_id] = {}
+    context.user_data.clear()
 
     # Show fresh main menu
-    keyboard = [
-        [InlineKeyboardButton("📊 Option Chain", callback_data="option_chain")],
-        [InlineKeyboardButton("📈 Market Data", callback_data="market_menu")],
-        [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "✅ Bot restarted! Choose an option:",
-        reply_markup=reply_markup,
+        reply_markup=MAIN_MENU_MARKUP,
     )
 
-    return CHOOSING_TYPE
-
 
 # ----- Option Chain existing flow (unchanged except start menu) ----- #
 
-async def option_chain_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def option_chain_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
 
-    keyboard = [
-        [InlineKeyboardButton("📈 Index Options", callback_data="index_options")],
-        [InlineKeyboardButton("📉 Stock Options", callback_data="stock_options")],
-        [InlineKeyboardButton("🧮 Market Data", callback_data="market_menu")],
-        [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
-        [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
-
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "Choose option type:",
-        reply_markup=reply_markup,
+        reply_markup=OPTION_CHAIN_MARKUP,
     )
 
-    return CHOOSING_TYPE
 
-
-async def index_options_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def index_options_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer()
 
-    user_states[user_id]["option_type"] = "indices"
-
-    keyboard = []
-    for idx in INDICES_LIST:
-        keyboard.append(
-            [InlineKeyboardButton(INDICES[idx], callback_data=f"idx_{idx}")]
-        )
+    context.user_data["option_type"] = "indices"
 
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="option_chain")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "Select an Index:",
-        reply_markup=reply_markup,
+        reply_markup=INDEX_KEYBOARD_MARKUP,
     )
 
-    return CHOOSING_INDEX
 
-
-async def stock_options_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def stock_options_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer()
 
-    user_states[user_id]["option_type"] = "equities"
+    context.user_data["option_type"] = "equities"
 
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "📝 Enter stock symbol (e.g., RELIANCE, TCS, INFY):\n\n"
         "(Type /cancel to go back)"
     )
 
-    return CHOOSING_STOCK
-
 
-async def handle_stock_symbol(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id
+async def handle_stock_symbol(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     symbol = update.message.text.strip().upper()
 
     if symbol == "/CANCEL":
@@ -178,48 +273,43 @@ async def handle_stock_symbol(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(
             "❌ Invalid symbol. Please enter a valid stock symbol (e.g., RELIANCE)"
         )
-        return CHOOSING_STOCK
+        return
 
-    user_states[user_id]["symbol"] = symbol
+    context.user_data["symbol"] = symbol
 
     await update.message.reply_text("⏳ Fetching expiry dates...")
 
-    expiries = get_expiries(symbol, "equities")
+    expiries = await get_expiries(symbol, "equities")
 
     if not expiries:
         await update.message.reply_text(
             f"❌ Could not fetch expiries for {symbol}. "
             "Please check the symbol and try again."
         )
-        return CHOOSING_STOCK
+        return
 
     await show_expiry_menu(update, context, symbol, expiries)
 
-    return CHOOSING_EXPIRY
 
-
-async def handle_index_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_index_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer()
 
     symbol = query.data.split("_")[1]
-    user_states[user_id]["symbol"] = symbol
+    context.user_data["symbol"] = symbol
 
-    await query.edit_message_text("⏳ Fetching expiry dates...")
+    await _call_with_retry(query.edit_message_text, "⏳ Fetching expiry dates...")
 
-    expiries = get_expiries(symbol, "indices")
+    expiries = await get_expiries(symbol, "indices")
 
     if not expiries:
-        await query.edit_message_text(
+        await _call_with_retry(query.edit_message_text,
             f"❌ Could not fetch expiries for {symbol}. Please try again."
         )
-        return CHOOSING_INDEX
+        return
 
     await show_expiry_menu(update, context, symbol, expiries)
 
-    return CHOOSING_EXPIRY
-
 
 async def show_expiry_menu(
     update: Update,
@@ -239,7 +329,7 @@ async def show_expiry_menu(
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     if update.callback_query:
-        await update.callback_query.edit_message_text(
+        await _call_with_retry(update.callback_query.edit_message_text,
             f"Select Expiry for {symbol}:",
             reply_markup=reply_markup,
         )
@@ -250,22 +340,21 @@ async def show_expiry_menu(
         )
 
 
-async def handle_expiry_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_expiry_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = query.from_user.id
     await query.answer()
 
     expiry = query.data.split("exp_")[1]
-    symbol = user_states[user_id]["symbol"]
-    option_type = user_states[user_id]["option_type"]
+    symbol = context.user_data["symbol"]
+    option_type = context.user_data["option_type"]
 
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "⏳ Fetching option chain data...\n"
         "(This may take a few seconds)"
     )
 
     try:
-        option_chain_data = get_option_chain(symbol, expiry, option_type)
+        option_chain_data = await get_option_chain(symbol, expiry, option_type)
 
         message = format_option_chain_message(
             option_chain_data,
@@ -274,112 +363,62 @@ async def handle_expiry_selection(update: Update, context: ContextTypes.DEFAULT_
             option_type,
         )
 
-        keyboard = [
-            [InlineKeyboardButton("📊 New Query", callback_data="option_chain")],
-            [InlineKeyboardButton("📈 Market Data", callback_data="market_menu")],
-            [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
-            [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(
+        await _call_with_retry(query.edit_message_text,
             message,
-            reply_markup=reply_markup,
+            reply_markup=AFTER_CHAIN_MARKUP,
             parse_mode="HTML",
         )
 
     except Exception as e:
         logger.error(f"Error fetching option chain: {str(e)}")
-        await query.edit_message_text(
+        await _call_with_retry(query.edit_message_text,
             f"❌ Error fetching option chain: {str(e)}\n\nPlease try again."
         )
 
-    return SHOW_CHAIN
-
 
 # ----- Market Data menu and handlers ----- #
 
-async def market_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def market_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show market data menu."""
     query = update.callback_query
     await query.answer()
 
-    keyboard = [
-        [InlineKeyboardButton("🔥 Most Active", callback_data="most_active")],
-        [InlineKeyboardButton("🕒 Preopen Movers", callback_data="preopen_movers")],
-        [InlineKeyboardButton("🏦 FII / DII", callback_data="fiidii")],
-        [InlineKeyboardButton("📦 Block Deals", callback_data="block_deals")],
-        [InlineKeyboardButton("📊 Bulk Deals", callback_data="bulk_deals")],
-        [InlineKeyboardButton("⚡ India VIX", callback_data="indiavix")],
-        [InlineKeyboardButton("📈 Top Gainers", callback_data="top_gainers")],
-        [InlineKeyboardButton("📉 Top Losers", callback_data="top_losers")],
-        [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
-        [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
+    await _call_with_retry(query.edit_message_text,
         "Select Market Data:",
-        reply_markup=reply_markup,
+        reply_markup=MARKET_MENU_MARKUP,
     )
 
-    return CHOOSING_TYPE
 
-
-async def handle_market_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_market_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle all market data callbacks."""
     query = update.callback_query
     data = query.data
     await query.answer()
 
-    await query.edit_message_text("⏳ Fetching data...")
+    await _call_with_retry(query.edit_message_text, "⏳ Fetching data...")
 
     try:
-        if data == "most_active":
-            text = format_most_active()
-        elif data == "preopen_movers":
-            text = format_preopen_movers()
-        elif data == "fiidii":
-            text = format_fiidii()
-        elif data == "block_deals":
-            text = format_block_deals()
-        elif data == "bulk_deals":
-            text = format_bulk_deals()
-        elif data == "indiavix":
-            text = format_indiavix()
-        elif data == "top_gainers":
-            text = format_top_gainers()
-        elif data == "top_losers":
-            text = format_top_losers()
+        if data in _MARKET_FORMATTERS:
+            text = await _get_market_text(data)
         else:
             text = "❌ Unknown selection."
 
-        keyboard = [
-            [InlineKeyboardButton("🔁 Market Menu", callback_data="market_menu")],
-            [InlineKeyboardButton("📊 Option Chain", callback_data="option_chain")],
-            [InlineKeyboardButton("🏠 Home", callback_data="back_to_start")],
-            [InlineKeyboardButton("🔄 Restart", callback_data="restart")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(
+        await _call_with_retry(query.edit_message_text,
             text,
-            reply_markup=reply_markup,
+            reply_markup=AFTER_MARKET_MARKUP,
             parse_mode="HTML",
         )
 
     except Exception as e:
         logger.error(f"Error in market data callback: {str(e)}")
-        await query.edit_message_text(
+        await _call_with_retry(query.edit_message_text,
             f"❌ Error fetching data: {str(e)}\n\nPlease try again."
         )
 
-    return CHOOSING_TYPE
-
 
 # ----- Common navigation ----- #
 
-async def back_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def back_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Go back to main menu."""
     if update.callback_query:
         await update.callback_query.answer()
@@ -390,14 +429,23 @@ async def back_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return await start(update, context)
 
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("👋 Cancelled. Type /start to begin again.")
-    return ConversationHandler.END
 
 
 def main() -> None:
     TOKEN = "8230069689:AAG-80w1aVXL9uihe8ZPTaZTNNRnZzHvFPc"
-    application = Application.builder().token(TOKEN).build()
+    # Separate pools for getUpdates long-polling vs outbound sends, so a burst
+    # of edit_message_text calls can never starve polling (or vice versa). The
+    # rate limiter keeps us inside Telegram's 30 msg/sec bot limit.
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .request(HTTPXRequest(connection_pool_size=32, pool_timeout=10))
+        .get_updates_request(HTTPXRequest(connection_pool_size=4))
+        .rate_limiter(AIORateLimiter())
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("cancel", cancel))
@@ -417,6 +465,9 @@ def main() -> None:
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_stock_symbol)
     )
 
+    # Keep the market-data cache warm so callbacks answer from memory
+    application.job_queue.run_repeating(_refresh_market, interval=30, first=5)
+
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
@@ -1,11 +1,144 @@
+import asyncio
+import csv
+import heapq
+import httpx
+import io
 import nsepython as nse
+import os
 import pandas as pd
+import requests
+import time
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Tuple
 import logging
 
+# orjson decodes the multi-hundred-KB chain payloads several times faster
+# than stdlib json; fall back quietly if it isn't installed
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Headers NSE expects before it will serve its JSON APIs
+NSE_HEADERS = {
+    'User-Agent': (
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+        '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    ),
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://www.nseindia.com/',
+}
+
+# One keepalive client for every NSE call made from the event loop; opening a
+# fresh session per request would redo the TCP+TLS handshake every time.
+_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    headers=NSE_HEADERS,
+    timeout=10.0,
+)
+
+# NSE expires its session cookies after a short idle window, so a
+# prime-once approach eventually leaves every request failing with 401/403.
+# Cookies are re-primed proactively once they are older than this, and
+# forcibly whenever a request comes back unauthorised or as HTML.
+COOKIE_MAX_AGE = 300  # seconds
+
+_cookie_lock = asyncio.Lock()
+_cookies_primed_at = 0.0
+
+
+async def _prime_cookies(force: bool = False) -> None:
+    global _cookies_primed_at
+    async with _cookie_lock:
+        if force or time.monotonic() - _cookies_primed_at > COOKIE_MAX_AGE:
+            await _client.get('https://www.nseindia.com')
+            _cookies_primed_at = time.monotonic()
+
+
+async def _client_get(url: str) -> httpx.Response:
+    """GET on the shared client, re-priming cookies and retrying once on 401/403."""
+    await _prime_cookies()
+    resp = await _client.get(url)
+    if resp.status_code in (401, 403):
+        await _prime_cookies(force=True)
+        resp = await _client.get(url)
+    resp.raise_for_status()
+    return resp
+
+
+async def _fetch_json(url: str) -> Dict:
+    """GET an NSE API URL on the shared client, recovering from stale cookies."""
+    resp = await _client_get(url)
+    try:
+        return _json.loads(resp.content)
+    except ValueError:
+        # An HTML body instead of JSON usually means a dead session cookie
+        await _prime_cookies(force=True)
+        resp = await _client_get(url)
+        return _json.loads(resp.content)
+
+
+# Shared session for the synchronous NSE calls (market-data formatters). One
+# session means the TCP+TLS handshake happens once instead of per call, and a
+# pooled adapter lets concurrent workers share the connections.
+_NSE_SESSION = requests.Session()
+_NSE_SESSION.headers.update(NSE_HEADERS)
+_NSE_SESSION.mount(
+    'https://', HTTPAdapter(pool_connections=10, pool_maxsize=20)
+)
+
+_session_primed_at = 0.0
+
+
+def _prime_session(force: bool = False) -> None:
+    """Refresh the session's NSE cookies when stale, mirroring _prime_cookies."""
+    global _session_primed_at
+    if force or time.monotonic() - _session_primed_at > COOKIE_MAX_AGE:
+        _NSE_SESSION.get('https://www.nseindia.com', timeout=5)
+        _session_primed_at = time.monotonic()
+
+
+def _session_get(url: str) -> requests.Response:
+    """GET on the shared session, re-priming cookies and retrying once on 401/403."""
+    _prime_session()
+    resp = _NSE_SESSION.get(url, timeout=5)
+    if resp.status_code in (401, 403):
+        _prime_session(force=True)
+        resp = _NSE_SESSION.get(url, timeout=5)
+    resp.raise_for_status()
+    return resp
+
+
+def _session_json(url: str) -> Dict:
+    """GET an NSE API URL on the shared session, recovering from stale cookies."""
+    resp = _session_get(url)
+    try:
+        return _json.loads(resp.content)
+    except ValueError:
+        # An HTML body instead of JSON usually means a dead session cookie
+        _prime_session(force=True)
+        resp = _session_get(url)
+        return _json.loads(resp.content)
+
+
+def _session_csv(url: str) -> List[Dict]:
+    """GET a CSV URL on the shared session and return its rows as dicts."""
+    resp = _session_get(url)
+    return list(csv.DictReader(io.StringIO(resp.text)))
+
+
+def _to_float(value) -> float:
+    """Coerce an NSE payload value ('1,234.50', None, 12.5) to float."""
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return 0.0
+
 # Available indices for trading
 INDICES = {
     'NIFTY': 'NIFTY 50',
@@ -16,65 +149,136 @@ INDICES = {
 
 INDICES_LIST = list(INDICES.keys())
 
+# Expiry lists change at most once a week, so cache them per (symbol, option_type)
+# with a 1-hour TTL. A per-key lock deduplicates concurrent refreshes so a burst
+# of users tapping the same symbol produces a single NSE round-trip.
+EXPIRY_CACHE_TTL = 3600  # seconds
+
+_expiry_cache: Dict[Tuple[str, str], Tuple[List[str], float]] = {}
+_expiry_key_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
 
-def get_expiries(symbol: str, option_type: str = 'indices') -> List[str]:
+def _expiry_lock_for(key: Tuple[str, str]) -> asyncio.Lock:
+    lock = _expiry_key_locks.get(key)
+    if lock is None:
+        lock = _expiry_key_locks[key] = asyncio.Lock()
+    return lock
+
+
+async def get_expiries(symbol: str, option_type: str = 'indices') -> List[str]:
     """
     Fetch available expiry dates for a symbol.
-    
+
+    Results are cached in-process for EXPIRY_CACHE_TTL seconds, keyed by
+    (symbol, option_type); cache hits skip the NSE round-trip entirely.
+
     Args:
         symbol: Stock/Index symbol (e.g., 'NIFTY', 'RELIANCE')
         option_type: 'indices' or 'equities'
-    
+
     Returns:
         List of expiry date strings (e.g., ['27-Jan-2025', '03-Feb-2025'])
     """
-    try:
-        url = f'https://www.nseindia.com/api/option-chain-contract-info?symbol={symbol}'
-        payload = nse.nsefetch(url)
-        
-        if 'expiryDates' in payload:
-            return payload['expiryDates']
-        else:
-            logger.warning(f"No expiry dates found for {symbol}")
+    key = (symbol, option_type)
+
+    cached = _expiry_cache.get(key)
+    if cached and time.monotonic() < cached[1]:
+        return cached[0]
+
+    async with _expiry_lock_for(key):
+        # Another caller may have refreshed while we waited for the lock
+        cached = _expiry_cache.get(key)
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+
+        try:
+            url = f'https://www.nseindia.com/api/option-chain-contract-info?symbol={symbol}'
+            payload = await _fetch_json(url)
+
+            if 'expiryDates' in payload:
+                expiries = payload['expiryDates']
+                _expiry_cache[key] = (expiries, time.monotonic() + EXPIRY_CACHE_TTL)
+                return expiries
+            else:
+                logger.warning(f"No expiry dates found for {symbol}")
+                return []
+
+        except Exception as e:
+            logger.error(f"Error fetching expiries for {symbol}: {str(e)}")
             return []
-    
-    except Exception as e:
-        logger.error(f"Error fetching expiries for {symbol}: {str(e)}")
-        return []
 
 
-def get_option_chain(
-    symbol: str, 
-    expiry: str, 
+def _clear_expiry_cache() -> None:
+    """Drop all cached expiry lists (handy when debugging via /restart)."""
+    _expiry_cache.clear()
+
+
+get_expiries.cache_clear = _clear_expiry_cache
+
+# Option chains are cached for a few seconds so bursts of users tapping the
+# same expiry share one upstream fetch while still seeing near-live data.
+CHAIN_CACHE_TTL = float(os.environ.get('NSE_CHAIN_TTL_SECONDS', 15))
+
+_chain_cache: Dict[Tuple[str, str, str], Tuple[Dict, float]] = {}
+_chain_key_locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+
+
+def _chain_lock_for(key: Tuple[str, str, str]) -> asyncio.Lock:
+    lock = _chain_key_locks.get(key)
+    if lock is None:
+        lock = _chain_key_locks[key] = asyncio.Lock()
+    return lock
+
+
+async def get_option_chain(
+    symbol: str,
+    expiry: str,
     option_type: str = 'indices'
 ) -> Dict:
     """
     Fetch full option chain data for a symbol and expiry.
-    
+
+    Results are cached for CHAIN_CACHE_TTL seconds (NSE_CHAIN_TTL_SECONDS env
+    var, default 15), keyed by (symbol, expiry, option_type). Concurrent
+    misses on the same key are single-flighted behind a per-key lock.
+
     Args:
         symbol: Stock/Index symbol
         expiry: Expiry date string (e.g., '27-Jan-2025')
         option_type: 'indices' or 'equities'
-    
+
     Returns:
         Dictionary with option chain records
     """
-    try:
-        url = (
-            f'https://www.nseindia.com/api/option-chain-v3?type={option_type}'
-            f'&symbol={symbol}&expiry={expiry}'
-        )
-        payload = nse.nsefetch(url)
-        
-        if 'records' in payload and 'data' in payload['records']:
-            return payload['records']
-        else:
-            logger.warning(f"No option chain data found for {symbol} {expiry}")
+    key = (symbol, expiry, option_type)
+
+    cached = _chain_cache.get(key)
+    if cached and time.monotonic() < cached[1]:
+        return cached[0]
+
+    async with _chain_lock_for(key):
+        cached = _chain_cache.get(key)
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+
+        try:
+            url = (
+                f'https://www.nseindia.com/api/option-chain-v3?type={option_type}'
+                f'&symbol={symbol}&expiry={expiry}'
+            )
+            payload = await _fetch_json(url)
+
+            if 'records' in payload and 'data' in payload['records']:
+                records = payload['records']
+                _chain_cache[key] = (records, time.monotonic() + CHAIN_CACHE_TTL)
+                return records
+            else:
+                logger.warning(f"No option chain data found for {symbol} {expiry}")
+                return {'data': []}
+
+        except Exception as e:
+            logger.error(f"Error fetching option chain: {str(e)}")
             return {'data': []}
-    
-    except Exception as e:
-        logger.error(f"Error fetching option chain: {str(e)}")
-        return {'data': []}
 
 
 def calculate_activity_score(row: Dict) -> float:
@@ -88,27 +292,62 @@ def calculate_activity_score(row: Dict) -> float:
     Returns:
         Activity score (float)
     """
-    score = 0
-    
+    score = 0.0
+
     # CE activity
-    if 'CE' in row:
-        ce = row['CE']
-        ce_oi = ce.get('openInterest', 0) or 0
-        ce_volume = ce.get('totalTradedVolume', 0) or 0
-        ce_qty = (ce.get('totalBuyQuantity', 0) or 0) + (ce.get('totalSellQuantity', 0) or 0)
+    ce = row.get('CE')
+    if ce:
+        ce_oi = ce.get('openInterest') or 0
+        ce_volume = ce.get('totalTradedVolume') or 0
+        ce_qty = (ce.get('totalBuyQuantity') or 0) + (ce.get('totalSellQuantity') or 0)
         score += (ce_oi * 0.5) + (ce_volume * 0.3) + (ce_qty * 0.2)
-    
+
     # PE activity
-    if 'PE' in row:
-        pe = row['PE']
-        pe_oi = pe.get('openInterest', 0) or 0
-        pe_volume = pe.get('totalTradedVolume', 0) or 0
-        pe_qty = (pe.get('totalBuyQuantity', 0) or 0) + (pe.get('totalSellQuantity', 0) or 0)
+    pe = row.get('PE')
+    if pe:
+        pe_oi = pe.get('openInterest') or 0
+        pe_volume = pe.get('totalTradedVolume') or 0
+        pe_qty = (pe.get('totalBuyQuantity') or 0) + (pe.get('totalSellQuantity') or 0)
         score += (pe_oi * 0.5) + (pe_volume * 0.3) + (pe_qty * 0.2)
-    
+
     return score
 
 
+# Below this many strikes the plain-Python loop wins; above it the DataFrame
+# construction cost is repaid by C-level column arithmetic.
+_VECTORIZE_MIN_ROWS = 50
+
+_SCORE_COLUMNS = (
+    'CE_openInterest', 'CE_totalTradedVolume',
+    'CE_totalBuyQuantity', 'CE_totalSellQuantity',
+    'PE_openInterest', 'PE_totalTradedVolume',
+    'PE_totalBuyQuantity', 'PE_totalSellQuantity',
+)
+
+
+def _summarize_chain_vectorized(data: List[Dict]) -> Tuple[List[Dict], float, float]:
+    """
+    Vectorized equivalent of the per-row scoring loop: flatten the chain into
+    a DataFrame once and compute activity scores and OI totals as column
+    arithmetic. Returns (top5 rows, total CE OI, total PE OI); the rows
+    returned are the original nested dicts, selected by score rank.
+    """
+    df = pd.json_normalize(data, sep='_')
+    df = df.reindex(columns=_SCORE_COLUMNS, fill_value=0.0).fillna(0.0)
+
+    score = (
+        0.5 * (df['CE_openInterest'] + df['PE_openInterest'])
+        + 0.3 * (df['CE_totalTradedVolume'] + df['PE_totalTradedVolume'])
+        + 0.2 * (
+            df['CE_totalBuyQuantity'] + df['CE_totalSellQuantity']
+            + df['PE_totalBuyQuantity'] + df['PE_totalSellQuantity']
+        )
+    )
+
+    top5 = [data[i] for i in score.nlargest(5).index]
+    return top5, float(df['CE_openInterest'].sum()), float(df['PE_openInterest'].sum())
+
+
 def get_top5_active_strikes(
     option_chain_data: Dict,
     symbol: str,
@@ -127,150 +366,201 @@ def get_top5_active_strikes(
     """
     if not option_chain_data or 'data' not in option_chain_data:
         return []
-    
+
     try:
-        # Calculate activity for each strike
-        strikes_with_score = []
-        
-        for row in option_chain_data['data']:
-            score = calculate_activity_score(row)
-            strikes_with_score.append((row, score))
-        
-        # Sort by score descending
-        strikes_with_score.sort(key=lambda x: x[1], reverse=True)
-        
-        # Take top 5
-        top5 = [row for row, score in strikes_with_score[:5]]
-        
-        return top5
-    
+        data = option_chain_data['data']
+        if len(data) >= _VECTORIZE_MIN_ROWS:
+            return _summarize_chain_vectorized(data)[0]
+
+        # O(n log 5) partial selection instead of scoring + full-sorting
+        # every strike just to keep five of them
+        return heapq.nlargest(5, data, key=calculate_activity_score)
+
     except Exception as e:
         logger.error(f"Error getting top 5 strikes: {str(e)}")
         return []
 
 
-def format_strike_data(strike_row: Dict, strike_price: float) -> str:
-    output = f"\n<b>Strike: {strike_price:.2f}</b>\n"
+# Pre-built %-style templates for the hottest per-row lines; in a tight loop
+# one C-level interpolation beats re-running the f-string bytecode per field.
+_STRIKE_TMPL = "\n<b>Strike: %.2f</b>\n"
+_CE_TMPL = "📈 <b>CE:</b> LTP <code>%.2f</code> | OI <code>%.2f</code> | IV <code>%.2f%%</code>\n"
+_PE_TMPL = "📉 <b>PE:</b> LTP <code>%.2f</code> | OI <code>%.2f</code> | IV <code>%.2f%%</code>\n"
+
+
+def _append_strike_lines(parts: List[str], strike_row: Dict, strike_price: float) -> None:
+    parts.append(_STRIKE_TMPL % strike_price)
 
     # CE Data
-    if 'CE' in strike_row:
-        ce = strike_row['CE']
-        ce_ltp = ce.get('lastPrice', 0.0) or 0.0
-        ce_oi = ce.get('openInterest', 0.0) or 0.0
-        ce_iv = ce.get('impliedVolatility', 0.0) or 0.0
-
-        output += (
-            f"📈 <b>CE:</b> "
-            f"LTP <code>{ce_ltp:.2f}</code> | "
-            f"OI <code>{ce_oi:.2f}</code> | "
-            f"IV <code>{ce_iv:.2f}%</code>\n"
-        )
+    ce = strike_row.get('CE')
+    if ce:
+        parts.append(_CE_TMPL % (
+            ce.get('lastPrice') or 0.0,
+            ce.get('openInterest') or 0.0,
+            ce.get('impliedVolatility') or 0.0,
+        ))
     else:
-        output += "📈 CE: No data\n"
+        parts.append("📈 CE: No data\n")
 
     # PE Data
-    if 'PE' in strike_row:
-        pe = strike_row['PE']
-        pe_ltp = pe.get('lastPrice', 0.0) or 0.0
-        pe_oi = pe.get('openInterest', 0.0) or 0.0
-        pe_iv = pe.get('impliedVolatility', 0.0) or 0.0
-
-        output += (
-            f"📉 <b>PE:</b> "
-            f"LTP <code>{pe_ltp:.2f}</code> | "
-            f"OI <code>{pe_oi:.2f}</code> | "
-            f"IV <code>{pe_iv:.2f}%</code>\n"
-        )
+    pe = strike_row.get('PE')
+    if pe:
+        parts.append(_PE_TMPL % (
+            pe.get('lastPrice') or 0.0,
+            pe.get('openInterest') or 0.0,
+            pe.get('impliedVolatility') or 0.0,
+        ))
     else:
-        output += "📉 PE: No data\n"
+        parts.append("📉 PE: No data\n")
 
-    return output
 
+def format_strike_data(strike_row: Dict, strike_price: float) -> str:
+    parts: List[str] = []
+    _append_strike_lines(parts, strike_row, strike_price)
+    return "".join(parts)
 
-def format_option_chain_message(option_chain_data: Dict, symbol: str, expiry: str, option_type: str = 'indices') -> str:
-    top5_strikes = get_top5_active_strikes(option_chain_data, symbol, option_type)
-    if not top5_strikes:
-        return f"❌ No active strikes found for {symbol} {expiry}"
 
+def format_option_chain_message(option_chain_data: Dict, symbol: str, expiry: str, option_type: str = 'indices') -> str:
+    data = option_chain_data.get('data', []) if option_chain_data else []
+
+    if len(data) >= _VECTORIZE_MIN_ROWS:
+        top5_strikes, total_ce_oi, total_pe_oi = _summarize_chain_vectorized(data)
+        if not top5_strikes:
+            return f"❌ No active strikes found for {symbol} {expiry}"
+        pcr = (total_pe_oi / total_ce_oi) if total_ce_oi else 0.0
+        return _render_chain_message(top5_strikes, total_ce_oi, total_pe_oi, pcr, symbol, expiry)
+
+    # Single pass over the chain: accumulate CE/PE OI totals and keep the
+    # top-5 strikes in a size-5 min-heap, with the activity score inlined so
+    # each row's OI/volume lookups happen exactly once.
     total_ce_oi = 0.0
     total_pe_oi = 0.0
-    for row in option_chain_data.get('data', []):
-        if 'CE' in row:
-            total_ce_oi += row['CE'].get('openInterest', 0.0) or 0.0
-        if 'PE' in row:
-            total_pe_oi += row['PE'].get('openInterest', 0.0) or 0.0
+    heap = []  # (score, idx, row); idx breaks ties between equal scores
+
+    for idx, row in enumerate(data):
+        score = 0.0
+
+        ce = row.get('CE')
+        if ce:
+            ce_oi = ce.get('openInterest') or 0.0
+            ce_volume = ce.get('totalTradedVolume') or 0.0
+            ce_qty = (ce.get('totalBuyQuantity') or 0.0) + (ce.get('totalSellQuantity') or 0.0)
+            total_ce_oi += ce_oi
+            score += (ce_oi * 0.5) + (ce_volume * 0.3) + (ce_qty * 0.2)
+
+        pe = row.get('PE')
+        if pe:
+            pe_oi = pe.get('openInterest') or 0.0
+            pe_volume = pe.get('totalTradedVolume') or 0.0
+            pe_qty = (pe.get('totalBuyQuantity') or 0.0) + (pe.get('totalSellQuantity') or 0.0)
+            total_pe_oi += pe_oi
+            score += (pe_oi * 0.5) + (pe_volume * 0.3) + (pe_qty * 0.2)
+
+        if len(heap) < 5:
+            heapq.heappush(heap, (score, idx, row))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, idx, row))
+
+    heap.sort(key=lambda item: (-item[0], item[1]))
+    top5_strikes = [row for _, _, row in heap]
+    if not top5_strikes:
+        return f"❌ No active strikes found for {symbol} {expiry}"
 
     pcr = (total_pe_oi / total_ce_oi) if total_ce_oi else 0.0
+    return _render_chain_message(top5_strikes, total_ce_oi, total_pe_oi, pcr, symbol, expiry)
+
 
+def _render_chain_message(
+    top5_strikes: List[Dict],
+    total_ce_oi: float,
+    total_pe_oi: float,
+    pcr: float,
+    symbol: str,
+    expiry: str,
+) -> str:
     symbol_name = INDICES.get(symbol, symbol)
-    message = (
+    parts = [
         f"<b>🎯 {symbol_name}</b> | Expiry: <b>{expiry}</b>\n"
         f"PCR: <code>{pcr:.2f}</code> | "
         f"Total CE OI: <code>{total_ce_oi:.2f}</code> | "
         f"Total PE OI: <code>{total_pe_oi:.2f}</code>\n"
         + "=" * 50 + "\n"
         "<b>Top 5 Most Active Strikes:</b>\n"
-    )
+    ]
 
+    # Append the strike lines straight into parts rather than joining a
+    # sub-string per strike and joining again
     for strike_row in top5_strikes:
-        strike_price = strike_row.get('strikePrice', 0.0)
-        message += format_strike_data(strike_row, strike_price)
+        _append_strike_lines(parts, strike_row, strike_row.get('strikePrice', 0.0))
+
+    return "".join(parts)
+
+_MOST_ACTIVE_TMPL = (
+    "%d <b>%s</b> | LTP <code>%.2f</code> | Turnover <code>%.2f</code> | Vol <code>%.2f</code>"
+)
 
-    return message
 
 def format_most_active() -> str:
-    df = nse.nse_most_active()  # usually returns DataFrame[web:62]
-    df = df.head(10)
+    # Hit the endpoint directly and slice the record list; building a
+    # DataFrame just to head(10) costs more than the formatting itself
+    payload = _session_json(
+        'https://www.nseindia.com/api/live-analysis-most-active-securities?index=value'
+    )
     lines = ["🔥 <b>Most Active (By Value)</b>\n"]
-    for i, row in df.iterrows():
-        symbol = row.get("symbol")
-        ltp = row.get("lastPrice")
-        trn = row.get("totalTradedValue")
-        vol = row.get("quantityTraded")
-        lines.append(
-            f"{i+1} <b>{symbol}</b> | LTP <code>{ltp:.2f}</code> | Turnover <code>{trn:.2f}</code> | Vol <code>{vol:.2f}</code>"
-        )
+    for i, row in enumerate(payload.get('data', [])[:10], 1):
+        lines.append(_MOST_ACTIVE_TMPL % (
+            i,
+            row.get('symbol'),
+            _to_float(row.get('lastPrice')),
+            _to_float(row.get('totalTradedValue')),
+            _to_float(row.get('quantityTraded')),
+        ))
     return "\n".join(lines)
 
 
 def format_preopen_movers() -> str:
-    df = nse.nse_preopen_movers()  # preopen gainers/losers[web:62]
-    df = df.head(10)
+    # key=FO matches nse_preopen_movers' default universe (all F&O
+    # securities' pre-open board, not just NIFTY-50 constituents)
+    payload = _session_json(
+        'https://www.nseindia.com/api/market-data-pre-open?key=FO'
+    )
+    movers = []
+    for row in payload.get('data', []):
+        meta = row.get('metadata', {})
+        if abs(_to_float(meta.get('pChange'))) > 1.5:
+            movers.append(meta)
+
     lines = ["🕒 <b>Preopen Movers</b>\n"]
-    for i, row in df.iterrows():
-        symbol = row.get("symbol")
-        prev = row.get("previousClose")
-        open_ = row.get("lastPrice")
-        chg = row.get("pChange")
+    for i, row in enumerate(movers[:10], 1):
         lines.append(
-            f"{i+1} <b>{symbol}</b> | Prev <code>{prev:.2f}</code> | "
-            f"Open <code>{open_:.2f}</code> | Chg <code>{chg:.2f}%</code>"
+            f"{i} <b>{row.get('symbol')}</b> | Prev <code>{_to_float(row.get('previousClose')):.2f}</code> | "
+            f"Open <code>{_to_float(row.get('lastPrice')):.2f}</code> | "
+            f"Chg <code>{_to_float(row.get('pChange')):.2f}%</code>"
         )
     return "\n".join(lines)
 
 
 def format_fiidii() -> str:
-    df = nse.nse_fiidii()  # FII/DII flows table[web:62]
+    payload = _session_json('https://www.nseindia.com/api/fiidiiTradeReact')
+    rows = payload if isinstance(payload, list) else payload.get('data', [])
     lines = ["🏦 <b>FII / DII Activity</b>\n"]
-    for _, row in df.iterrows():
-        cat = row.get("category")
-        buy = row.get("buyValue")
-        sell = row.get("sellValue")
-        net = row.get("netValue")
+    for row in rows:
         lines.append(
-            f"<b>{cat}</b> | Buy <code>{buy}</code> | Sell <code>{sell}</code> | Net <code>{net}</code>"
+            f"<b>{row.get('category')}</b> | Buy <code>{row.get('buyValue')}</code> | "
+            f"Sell <code>{row.get('sellValue')}</code> | Net <code>{row.get('netValue')}</code>"
         )
     return "\n".join(lines)
 
 
 def format_block_deals() -> str:
-    df = nse.get_blockdeals()  # recent block deals[web:62]
-    df = df.head(10)
+    # The block-deal list is published as a CSV archive; DictReader over the
+    # shared session skips the DataFrame round-trip entirely
+    rows = _session_csv('https://archives.nseindia.com/content/equities/block.csv')
     lines = ["📦 <b>Recent Block Deals (Top 10)</b>\n"]
-    for _, row in df.iterrows():
+    for row in rows[:10]:
         symbol = row.get("Symbol")
-        qty = row.get("Quantity Traded")
-        price = row.get("Trade Price / Wght. Avg. Price")
+        qty = _to_float(row.get("Quantity Traded"))
+        price = _to_float(row.get("Trade Price / Wght. Avg. Price"))
         buyer = row.get("Client Name")
         seller = row.get("Client Name")
         lines.append(
@@ -282,14 +572,13 @@ def format_block_deals() -> str:
 
 
 def format_bulk_deals() -> str:
-    df = nse.get_bulkdeals()
-    df = df.head(20)
+    rows = _session_csv('https://archives.nseindia.com/content/equities/bulk.csv')
     lines = ["📊 <b>Recent Bulk Deals (Top 10)</b>\n"]
-    
-    for _, row in df.iterrows():
+
+    for row in rows[:20]:
         symbol = row.get("Symbol") or row.get("SYMBOL") or ""
-        qty = row.get("Quantity Traded") or row.get("QUANTITY") or 0.0
-        price = row.get("Trade Price / Wght. Avg. Price") or row.get("PRICE") or 0.0
+        qty = _to_float(row.get("Quantity Traded") or row.get("QUANTITY"))
+        price = _to_float(row.get("Trade Price / Wght. Avg. Price") or row.get("PRICE"))
         
         client_name = row.get("Client Name") or row.get("CLIENT_NAME") or ""
         client_type = row.get("Buy/Sell") or row.get("TRADE_TYPE") or ""
@@ -335,7 +624,11 @@ def format_bulk_deals() -> str:
 
 
 def format_indiavix() -> str:
-    vix = nse.indiavix()  # dict with index data[web:62]
+    payload = _session_json('https://www.nseindia.com/api/allIndices')
+    vix = next(
+        (row for row in payload.get('data', []) if 'VIX' in row.get('index', '')),
+        {},
+    )
     ltp = vix.get("last") or vix.get("lastPrice") or 0.0
     chg = vix.get("variation") or vix.get("change") or 0.0
     pchg = vix.get("percentChange") or 0.0
@@ -355,15 +648,16 @@ def format_indiavix() -> str:
 
 def format_top_gainers() -> str:
     df = nse.nse_get_top_gainers()  # top gainers list[web:6]
-    df = df.head(10)
     lines = ["📈 <b>Top Gainers</b>\n"]
-    for i, row in df.iterrows():
+    # record dicts rather than itertuples: the column set varies, so the
+    # .get fallback chains below need dict access
+    for i, row in enumerate(df.head(10).to_dict('records'), 1):
         symbol = row.get("symbol") or row.get("SYMBOL") or ""
         ltp = row.get("ltp") or row.get("LTP") or 0.0
         pchg = row.get("netPrice") or row.get("%CHNG") or 0.0
         vol = row.get("tradedQuantity") or row.get("VOLUME") or 0.0
         lines.append(
-            f"{i+1} <b>{symbol}</b> | LTP <code>{ltp:.2f}</code> | "
+            f"{i} <b>{symbol}</b> | LTP <code>{ltp:.2f}</code> | "
             f"Chg <code>{pchg:.2f}%</code> | Vol <code>{vol:.2f}</code>"
         )
     return "\n".join(lines)
@@ -371,15 +665,14 @@ def format_top_gainers() -> str:
 
 def format_top_losers() -> str:
     df = nse.nse_get_top_losers()  # top losers list[web:6]
-    df = df.head(10)
     lines = ["📉 <b>Top Losers</b>\n"]
-    for i, row in df.iterrows():
+    for i, row in enumerate(df.head(10).to_dict('records'), 1):
         symbol = row.get("symbol") or row.get("SYMBOL") or ""
         ltp = row.get("ltp") or row.get("LTP") or 0.0
         pchg = row.get("netPrice") or row.get("%CHNG") or 0.0
         vol = row.get("tradedQuantity") or row.get("VOLUME") or 0.0
         lines.append(
-            f"{i+1} <b>{symbol}</b> | LTP <code>{ltp:.2f}</code> | "
+            f"{i} <b>{symbol}</b> | LTP <code>{ltp:.2f}</code> | "
             f"Chg <code>{pchg:.2f}%</code> | Vol <code>{vol:.2f}</code>"
             )
     return "\n".join(lines)